@@ -3,12 +3,27 @@ import sys
 import datetime
 import prettytable
 import json
+import math
+import os
+import csv
+import tempfile
 
 SEVERITY_KEY = 'customfield_12010'
 PRIORITY_KEY = 'customfield_12009'
 
 HELP_STRING = 'expected: <endpoint> <jira-username> <jira-password> ' \
-              '<project-label> <start-date> <end-date> <summarise|dump>'
+              '<project-label> <start-date> <end-date> <summarise|dump|trend> [rollup-path] ' \
+              '[--format=table|json|ndjson|csv] [--page-size=<rows>] [--no-fetch]\n' \
+              'json/ndjson write unclassified bug levels as null, csv leaves them empty'
+
+OUTPUT_FORMATS = ['table', 'json', 'ndjson', 'csv']
+
+ROLLUP_DATE_FORMAT = '%Y-%m-%d'
+ROLLUP_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S%z'
+SEARCH_PAGE_SIZE = 100
+
+# Re-fetch a little before the last sync so issues still being indexed when it ran aren't missed.
+ROLLUP_SYNC_OVERLAP = datetime.timedelta(hours=1)
 
 class JiraController:
     def __init__(self, jira_endpoint, jira_username, jira_password):
@@ -30,13 +45,42 @@ class JiraController:
             raise RuntimeError('Bug query failed, %s, "%s"' % (response.status_code, response.reason))
         return response.json()
 
+    def get_bugs_updated_within(self, project_label, minutes):
+        # Relative to Jira's own clock, so the searching user's profile timezone doesn't matter.
+        # Ordering by key keeps pages stable while issues are created or updated mid sync.
+        jql = 'jql=project=Bugs+and+"Project+Label"=%s+and+updated>=-%sm+order+by+key+ASC' % \
+              (project_label, minutes)
+        issues = []
+
+        # Page through every result, an incremental sync can't afford to drop any.
+        while True:
+            other_params = 'expand=changelog&startAt=%s&maxResults=%s' % (len(issues), SEARCH_PAGE_SIZE)
+            response = requests.get('%s/rest/api/2/search/?%s&%s' % (self.endpoint, other_params, jql),
+                                    headers={
+                                        'Content-Type': 'application/json'
+                                    },
+                                    auth=(self.username, self.password))
+
+            if response.status_code != 200:
+                raise RuntimeError('Bug query failed, %s, "%s"' % (response.status_code, response.reason))
+            response_data = response.json()
+            issues.extend(response_data['issues'])
+            if not response_data['issues'] or len(issues) >= response_data['total']:
+                return {'issues': issues}
+
 
 def get_cleansed_bugs(start_days, end_days, raw_bugs):
-    cleansed_bugs = {}
+    return dict(iter_cleansed_bugs(start_days, end_days, raw_bugs))
+
+
+def iter_cleansed_bugs(start_days, end_days, raw_bugs):
+    """
+    Yields (bug key, cleansed bug) pairs one bug at a time so output can be streamed.
+    """
     current_date = datetime.datetime.now()
     for bug in raw_bugs['issues']:
+        cleansed_bugs = {}
         bug_key = bug['key']
-        get_bug_level(bug)
 
         for history in bug['changelog']['histories']:
 
@@ -63,7 +107,7 @@ def get_cleansed_bugs(start_days, end_days, raw_bugs):
         # Order transitions chronologically.
         if bug_key in cleansed_bugs:
             cleansed_bugs[bug_key]['transitions'] = list(reversed(cleansed_bugs[bug_key]['transitions']))
-    return cleansed_bugs
+            yield bug_key, cleansed_bugs[bug_key]
 
 
 def get_bug_level(bug):
@@ -103,33 +147,354 @@ def summarise_bugs(bugs):
     return cleansed_summary
 
 
-def print_bugs(bugs):
-    table = prettytable.PrettyTable()
-    table.field_names = ['Bug', 'Level', 'From', 'To']
-    for key, bug in bugs.items():
-        first_trans = bug['transitions'][0]
-        table.add_row([key, bug['level'], first_trans['from'], first_trans['to']])
-        for trans in bug['transitions'][1:]:
-            table.add_row(['', '', trans['from'], trans['to']])
-        table.add_row(['', '', '', ''])
-    print(table)
+class BugRollupStore:
+    """
+    Persistent per day x level x transition counts of bug status changes. Each bug's level and
+    the transitions of its changelog histories are kept too, keyed on history id, so overlapping
+    queries only add what is new and a reclassified bug's counts can be moved to its new level.
+    """
+    def __init__(self, path, project_label):
+        self.path = path
+        self.project_label = project_label
+        self.bugs = {}
+        self.days = {}
+        self.synced_from = None
+        self.last_synced = None
+
+        if os.path.exists(path):
+            with open(path, 'r') as rollup_file:
+                data = json.load(rollup_file)
+            if data['project_label'] != project_label:
+                raise RuntimeError('Rollup store "%s" belongs to project label "%s"' %
+                                   (path, data['project_label']))
+            self.bugs = data['bugs']
+            self.days = data['days']
+            if data['synced_from'] is not None:
+                self.synced_from = datetime.datetime.strptime(data['synced_from'], ROLLUP_DATE_FORMAT).date()
+                self.last_synced = datetime.datetime.strptime(data['last_synced'], ROLLUP_TIME_FORMAT)
+
+    def sync(self, controller, start_date):
+        """
+        Fetches only bugs updated since the last sync, or everything updated since start_date
+        when the store doesn't reach back that far yet. Only elapsed time is sent to Jira, never
+        a local wall clock time.
+        """
+        sync_time = datetime.datetime.now(datetime.timezone.utc)
+        if self.synced_from is None or start_date < self.synced_from:
+            # Whole days back from today, plus one more to cover the part of today already gone.
+            window = datetime.timedelta(days=(datetime.date.today() - start_date).days + 1)
+            self.synced_from = start_date
+        else:
+            window = sync_time - self.last_synced + ROLLUP_SYNC_OVERLAP
+
+        minutes = int(math.ceil(window.total_seconds() / 60))
+        self.update(controller.get_bugs_updated_within(self.project_label, minutes))
+        self.last_synced = sync_time
+        self.save()
+
+    def update(self, raw_bugs):
+        for bug in raw_bugs['issues']:
+            bug_key = bug['key']
+            level = get_bug_level(bug)
+            stored_bug = self.bugs.get(bug_key)
+
+            # Unclassified bugs aren't counted, and their histories aren't marked as seen so
+            # they are picked up once the bug is given a level.
+            if level == 'NA':
+                if stored_bug is not None:
+                    self.move_bug_transitions(stored_bug, -1)
+                    del self.bugs[bug_key]
+                continue
+
+            if stored_bug is None:
+                stored_bug = self.bugs[bug_key] = {
+                    'level': level,
+                    'histories': {}
+                }
+            elif stored_bug['level'] != level:
+                self.move_bug_transitions(stored_bug, -1)
+                stored_bug['level'] = level
+                self.move_bug_transitions(stored_bug, 1)
+
+            for history in bug['changelog']['histories']:
+                if history['id'] in stored_bug['histories']:
+                    continue
+
+                day = history['created'].split('T')[0]
+                transitions = []
+                for history_item in history['items']:
+                    if 'fieldId' in history_item and history_item['fieldId'] == 'status':
+                        transitions.append([day, history_item['fromString'], history_item['toString']])
+                        self.add_transition(day, level, history_item['fromString'], history_item['toString'], 1)
+
+                # Histories without a status change never affect a count, so aren't worth storing.
+                if transitions:
+                    stored_bug['histories'][history['id']] = transitions
+
+    def move_bug_transitions(self, stored_bug, delta):
+        for transitions in stored_bug['histories'].values():
+            for day, from_status, to_status in transitions:
+                self.add_transition(day, stored_bug['level'], from_status, to_status, delta)
+
+    def add_transition(self, day, level, from_status, to_status, delta):
+        # JSON object keys are always strings, so store levels as strings too.
+        transitions = self.days.setdefault(day, {}).setdefault(str(level), {})
+        transition_key = '%s -> %s' % (from_status, to_status)
+        if transition_key not in transitions:
+            transitions[transition_key] = {
+                'count': 0,
+                'to': to_status,
+                'from': from_status
+            }
+        transitions[transition_key]['count'] += delta
+
+        # Drop emptied buckets so moved counts don't leave zero rows behind.
+        if transitions[transition_key]['count'] == 0:
+            del transitions[transition_key]
+            if not transitions:
+                del self.days[day][str(level)]
+                if not self.days[day]:
+                    del self.days[day]
+
+    def save(self):
+        data = {
+            'project_label': self.project_label,
+            'bugs': self.bugs,
+            'days': self.days,
+            'synced_from': self.synced_from.strftime(ROLLUP_DATE_FORMAT) if self.synced_from else None,
+            'last_synced': self.last_synced.strftime(ROLLUP_TIME_FORMAT) if self.last_synced else None
+        }
+        # Each run writes its own temp file so concurrent runs can't clobber one another's. The
+        # last one to finish replaces the store whole.
+        with tempfile.NamedTemporaryFile('w', dir=os.path.dirname(os.path.abspath(self.path)),
+                                         prefix=os.path.basename(self.path), suffix='.tmp',
+                                         delete=False) as rollup_file:
+            json.dump(data, rollup_file)
+        try:
+            os.replace(rollup_file.name, self.path)
+        except OSError:
+            os.remove(rollup_file.name)
+            raise
+
+    def get_days(self, start_date, end_date):
+        start_str = start_date.strftime(ROLLUP_DATE_FORMAT)
+        end_str = end_date.strftime(ROLLUP_DATE_FORMAT)
+        # ISO dates sort lexically, so no need to parse every key.
+        for day, levels in self.days.items():
+            if start_str <= day <= end_str:
+                yield day, levels
+
+    def summarise(self, start_date, end_date):
+        summary = {}
+        for day, levels in self.get_days(start_date, end_date):
+            merge_rollup_levels(summary, levels)
+
+        cleansed_summary = {}
+        for level, transitions in summary.items():
+            cleansed_summary[level] = list(transitions.values())
+        return cleansed_summary
+
+    def weekly_trend(self, start_date, end_date):
+        """
+        Returns summaries for every whole calendar week the range touches, plus the week before
+        the first one as the baseline it is compared against.
+        """
+        first_week_start, last_week_start = get_trend_weeks(start_date, end_date)
+        weeks = {}
+        week_start = first_week_start
+        while week_start <= last_week_start:
+            weeks[week_start] = {}
+            week_start += datetime.timedelta(weeks=1)
+
+        for day, levels in self.get_days(first_week_start, last_week_start + datetime.timedelta(days=6)):
+            date = datetime.datetime.strptime(day, ROLLUP_DATE_FORMAT).date()
+            week_start = date - datetime.timedelta(days=date.weekday())
+            merge_rollup_levels(weeks[week_start], levels)
+        return weeks
+
+
+def get_trend_weeks(start_date, end_date):
+    """
+    Returns the start of the baseline week before start_date's week and of end_date's week.
+    """
+    first_week_start = start_date - datetime.timedelta(days=start_date.weekday(), weeks=1)
+    last_week_start = end_date - datetime.timedelta(days=end_date.weekday())
+    return first_week_start, last_week_start
+
+
+def merge_rollup_levels(summary, levels):
+    for level, transitions in levels.items():
+        level_summary = summary.setdefault(int(level), {})
+        for transition_key, transition in transitions.items():
+            if transition_key not in level_summary:
+                level_summary[transition_key] = {
+                    'count': 0,
+                    'to': transition['to'],
+                    'from': transition['from']
+                }
+            level_summary[transition_key]['count'] += transition['count']
+
+
+def write_records(records, field_names, output_format):
+    """
+    Writes flat records to stdout as they arrive rather than collecting them first.
+    """
+    if output_format == 'csv':
+        writer = csv.DictWriter(sys.stdout, fieldnames=field_names)
+        writer.writeheader()
+        for record in records:
+            writer.writerow(record)
+    elif output_format == 'ndjson':
+        for record in records:
+            sys.stdout.write(json.dumps(record) + '\n')
+    elif output_format == 'json':
+        separator = '[\n'
+        for record in records:
+            sys.stdout.write(separator + json.dumps(record))
+            separator = ',\n'
+        sys.stdout.write('[]\n' if separator == '[\n' else '\n]\n')
+    else:
+        raise RuntimeError('Unrecognised output format \'%s\'' % output_format)
+    sys.stdout.flush()
+
+
+def write_table(row_groups, field_names, page_size=0):
+    """
+    Prints groups of rows as tables, starting a new table once a page holds page_size rows.
+    A page size of 0 prints everything as one table.
+    """
+    table = None
+    for rows in row_groups:
+        if table is None:
+            table = prettytable.PrettyTable()
+            table.field_names = field_names
+        elif page_size and len(table.rows) >= page_size:
+            print(table.get_string())
+            table = prettytable.PrettyTable()
+            table.field_names = field_names
+        else:
+            table.add_row([''] * len(field_names))
+
+        for row in rows:
+            table.add_row(row)
+
+    if table is None:
+        table = prettytable.PrettyTable()
+        table.field_names = field_names
+    print(table.get_string())
+
 
+def print_bugs(bugs, output_format='table', page_size=0):
+    """
+    Prints (bug key, cleansed bug) pairs, which may be a generator.
+    """
+    if output_format != 'table':
+        # Unclassified bugs get a null level so the column stays numeric for consumers.
+        write_records(({'bug': key, 'level': None if bug['level'] == 'NA' else bug['level'],
+                        'from': trans['from'], 'to': trans['to']}
+                       for key, bug in bugs for trans in bug['transitions']),
+                      ['bug', 'level', 'from', 'to'], output_format)
+        return
 
-def print_summary(bug_summary):
-    table = prettytable.PrettyTable()
-    table.field_names = ['Level', 'From', 'To', 'Count']
+    def get_row_groups():
+        for key, bug in bugs:
+            first_trans = bug['transitions'][0]
+            rows = [[key, bug['level'], first_trans['from'], first_trans['to']]]
+            for trans in bug['transitions'][1:]:
+                rows.append(['', '', trans['from'], trans['to']])
+            yield rows
 
-    first_level = True
-    for level, transitions in sorted(bug_summary.items()):
-        if not first_level:
-            table.add_row(['', '', '', ''])
-        first_level = False
+    write_table(get_row_groups(), ['Bug', 'Level', 'From', 'To'], page_size)
 
-        table.add_row([str(level), transitions[0]['from'], transitions[0]['to'], transitions[0]['count']])
-        for transition in transitions[1:]:
-            table.add_row(['', transition['from'], transition['to'], transition['count']])
 
-    print(table.get_string())
+def print_summary(bug_summary, output_format='table', page_size=0):
+    if output_format != 'table':
+        write_records(({'level': level, 'from': transition['from'], 'to': transition['to'],
+                        'count': transition['count']}
+                       for level, transitions in sorted(bug_summary.items()) for transition in transitions),
+                      ['level', 'from', 'to', 'count'], output_format)
+        return
+
+    def get_row_groups():
+        for level, transitions in sorted(bug_summary.items()):
+            rows = [[str(level), transitions[0]['from'], transitions[0]['to'], transitions[0]['count']]]
+            for transition in transitions[1:]:
+                rows.append(['', transition['from'], transition['to'], transition['count']])
+            yield rows
+
+    write_table(get_row_groups(), ['Level', 'From', 'To', 'Count'], page_size)
+
+
+def iter_trend_records(weekly_trend):
+    """
+    Yields each week's counts against the week before, including transitions that dropped to 0.
+    The first week is only used as a baseline.
+    """
+    weeks = sorted(weekly_trend.items())
+    for (_, previous_week), (week_start, summary) in zip(weeks, weeks[1:]):
+        for level in sorted(set(summary) | set(previous_week)):
+            transitions = summary.get(level, {})
+            previous_transitions = previous_week.get(level, {})
+            for transition_key in sorted(set(transitions) | set(previous_transitions)):
+                transition = transitions.get(transition_key, previous_transitions.get(transition_key))
+                count = transitions.get(transition_key, {}).get('count', 0)
+                previous_count = previous_transitions.get(transition_key, {}).get('count', 0)
+                yield {
+                    'week': week_start.strftime(ROLLUP_DATE_FORMAT),
+                    'level': level,
+                    'from': transition['from'],
+                    'to': transition['to'],
+                    'count': count,
+                    'change': count - previous_count
+                }
+
+
+def print_trend(weekly_trend, output_format='table', page_size=0):
+    field_names = ['week', 'level', 'from', 'to', 'count', 'change']
+    if output_format != 'table':
+        write_records(iter_trend_records(weekly_trend), field_names, output_format)
+        return
+
+    def get_row_groups():
+        rows = []
+        for record in iter_trend_records(weekly_trend):
+            if rows and record['week'] != rows[0][0]:
+                yield rows
+                rows = []
+            rows.append([record['week'], str(record['level']), record['from'], record['to'], record['count'],
+                         '%+d' % record['change']])
+        if rows:
+            yield rows
+
+    def blank_repeated_weeks(row_groups):
+        for rows in row_groups:
+            yield [rows[0]] + [[''] + row[1:] for row in rows[1:]]
+
+    write_table(blank_repeated_weeks(get_row_groups()),
+                ['Week', 'Level', 'From', 'To', 'Count', 'Change'], page_size)
+
+
+def pop_option(args, name, default):
+    """
+    Removes a '--name=value' option from args and returns its value.
+    """
+    prefix = '--%s=' % name
+    for arg in args:
+        if arg.startswith(prefix):
+            args.remove(arg)
+            return arg[len(prefix):]
+    return default
+
+
+def pop_flag(args, name):
+    """
+    Removes a '--name' flag from args and returns whether it was given.
+    """
+    flag = '--%s' % name
+    if flag in args:
+        args.remove(flag)
+        return True
+    return False
 
 
 def get_date_from_str(date_str):
@@ -144,32 +509,63 @@ def get_days_since_date(date):
 
 
 def main():
-    if len(sys.argv) != 8:
+    args = list(sys.argv)
+    output_format = pop_option(args, 'format', 'table')
+    page_size = pop_option(args, 'page-size', '0')
+    no_fetch = pop_flag(args, 'no-fetch')
+    if len(args) not in [8, 9] or output_format not in OUTPUT_FORMATS or not page_size.isdigit():
         print(HELP_STRING)
         return
-
-    jira_endpoint = sys.argv[1]
-    jira_username = sys.argv[2]
-    jira_password = sys.argv[3]
-    project_label = sys.argv[4]
-    start_days = get_days_since_date(get_date_from_str(sys.argv[5]))
-    end_days = get_days_since_date(get_date_from_str(sys.argv[6]))
-
-    if sys.argv[7] not in ['summarise', 'dump']:
+    page_size = int(page_size)
+
+    jira_endpoint = args[1]
+    jira_username = args[2]
+    jira_password = args[3]
+    project_label = args[4]
+    start_date = get_date_from_str(args[5])
+    end_date = get_date_from_str(args[6])
+    start_days = get_days_since_date(start_date)
+    end_days = get_days_since_date(end_date)
+    mode = args[7]
+    rollup_path = args[8] if len(args) == 9 else None
+
+    if mode not in ['summarise', 'dump', 'trend'] or \
+            (rollup_path is None and (mode == 'trend' or no_fetch)) or \
+            (rollup_path is not None and mode == 'dump'):
         print(HELP_STRING)
         return
-    summarise = (sys.argv[7] == 'summarise')
+    summarise = (mode == 'summarise')
 
     controller = JiraController(jira_endpoint, jira_username, jira_password)
-    raw_bugs = controller.get_bugs(project_label, start_days, end_days)
 
-    bugs = get_cleansed_bugs(start_days, end_days, raw_bugs)
+    if rollup_path is not None:
+        # Trends also need the week before the range as a baseline.
+        sync_start_date = get_trend_weeks(start_date, end_date)[0] if mode == 'trend' else start_date
+
+        rollup_store = BugRollupStore(rollup_path, project_label)
+        if not no_fetch:
+            rollup_store.sync(controller, sync_start_date)
+        elif rollup_store.synced_from is None:
+            raise RuntimeError('Rollup store "%s" has never been synced' % rollup_path)
+        elif sync_start_date < rollup_store.synced_from:
+            sys.stderr.write('Rollup store only covers changes since %s\n' %
+                             rollup_store.synced_from.strftime(ROLLUP_DATE_FORMAT))
+
+        if mode == 'trend':
+            print_trend(rollup_store.weekly_trend(start_date, end_date), output_format, page_size)
+        else:
+            print_summary(rollup_store.summarise(start_date, end_date), output_format, page_size)
+        return
+
+    raw_bugs = controller.get_bugs(project_label, start_days, end_days)
 
     if summarise:
+        bugs = get_cleansed_bugs(start_days, end_days, raw_bugs)
         bug_summary = summarise_bugs(bugs)
-        print_summary(bug_summary)
+        print_summary(bug_summary, output_format, page_size)
     else:
-        print_bugs(bugs)
+        # Dump bugs as they are cleansed instead of building them all up front.
+        print_bugs(iter_cleansed_bugs(start_days, end_days, raw_bugs), output_format, page_size)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,163 @@
+import datetime
+import importlib.util
+import os
+
+import pytest
+
+# The script's name isn't a valid module name, so load it from its path.
+spec = importlib.util.spec_from_file_location(
+    'bug_summary', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bug-summary.py'))
+bug_summary = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(bug_summary)
+
+START_DATE = datetime.date(2026, 10, 1)
+END_DATE = datetime.date(2026, 10, 31)
+
+
+def make_history(history_id, day, from_status, to_status):
+    return {
+        'id': str(history_id),
+        'created': '%sT10:00:00.000+0000' % day,
+        'items': [{'fieldId': 'status', 'fromString': from_status, 'toString': to_status}]
+    }
+
+
+def make_bug(bug_key, histories, severity=2, priority=3):
+    return {
+        'key': bug_key,
+        'fields': {
+            bug_summary.SEVERITY_KEY: {'value': 'S%d' % severity} if severity else None,
+            bug_summary.PRIORITY_KEY: {'value': 'P%d' % priority} if priority else None
+        },
+        'changelog': {
+            'histories': histories
+        }
+    }
+
+
+def get_counts(summary):
+    return {(level, transition['from'], transition['to']): transition['count']
+            for level, transitions in summary.items() for transition in transitions}
+
+
+@pytest.fixture
+def store(tmp_path):
+    return bug_summary.BugRollupStore(str(tmp_path / 'rollup.json'), 'LABEL')
+
+
+HISTORIES = [
+    make_history(1, '2026-10-05', 'New', 'Open'),
+    make_history(2, '2026-10-13', 'Open', 'Closed'),
+]
+
+
+def test_repeated_history_is_counted_once(store):
+    store.update({'issues': [make_bug('BUG-1', HISTORIES)]})
+    store.update({'issues': [make_bug('BUG-1', HISTORIES)]})
+    assert get_counts(store.summarise(START_DATE, END_DATE)) == {
+        (3, 'New', 'Open'): 1,
+        (3, 'Open', 'Closed'): 1,
+    }
+
+
+def test_histories_without_status_changes_are_not_stored(store):
+    comment = {'id': '3', 'created': '2026-10-06T10:00:00.000+0000', 'items': [{'field': 'Comment'}]}
+    store.update({'issues': [make_bug('BUG-1', HISTORIES + [comment])]})
+    assert sorted(store.bugs['BUG-1']['histories']) == ['1', '2']
+
+
+def test_reclassified_bug_moves_counts_to_new_level(store):
+    store.update({'issues': [make_bug('BUG-1', HISTORIES)]})
+    store.update({'issues': [make_bug('BUG-1', HISTORIES, severity=6, priority=6)]})
+    assert get_counts(store.summarise(START_DATE, END_DATE)) == {
+        (7, 'New', 'Open'): 1,
+        (7, 'Open', 'Closed'): 1,
+    }
+
+
+def test_unclassified_bug_is_counted_once_given_a_level(store):
+    store.update({'issues': [make_bug('BUG-1', HISTORIES)]})
+    store.update({'issues': [make_bug('BUG-1', HISTORIES, severity=None, priority=None)]})
+    assert store.summarise(START_DATE, END_DATE) == {}
+    assert 'BUG-1' not in store.bugs
+
+    store.update({'issues': [make_bug('BUG-1', HISTORIES, severity=1, priority=1)]})
+    assert get_counts(store.summarise(START_DATE, END_DATE)) == {
+        (1, 'New', 'Open'): 1,
+        (1, 'Open', 'Closed'): 1,
+    }
+
+
+def test_store_round_trips_through_save(store):
+    store.update({'issues': [make_bug('BUG-1', HISTORIES)]})
+    store.save()
+    loaded_store = bug_summary.BugRollupStore(store.path, 'LABEL')
+    assert loaded_store.summarise(START_DATE, END_DATE) == store.summarise(START_DATE, END_DATE)
+
+
+def test_trend_reports_transitions_that_drop_to_zero(store):
+    store.update({'issues': [make_bug('BUG-1', [
+        make_history(1, '2026-09-29', 'New', 'Open'),
+        make_history(2, '2026-10-05', 'New', 'Open'),
+        make_history(3, '2026-10-06', 'New', 'Open'),
+        make_history(4, '2026-10-13', 'Open', 'Closed'),
+    ])]})
+
+    # Starting mid week still compares whole weeks, against the week before as a baseline.
+    records = list(bug_summary.iter_trend_records(
+        store.weekly_trend(datetime.date(2026, 10, 7), datetime.date(2026, 10, 20))))
+    assert [(record['week'], record['from'], record['to'], record['count'], record['change'])
+            for record in records] == [
+        ('2026-10-05', 'New', 'Open', 2, 1),
+        ('2026-10-12', 'New', 'Open', 0, -2),
+        ('2026-10-12', 'Open', 'Closed', 1, 1),
+        ('2026-10-19', 'Open', 'Closed', 0, -1),
+    ]
+
+
+class FakeController:
+    def __init__(self, raw_bugs):
+        self.raw_bugs = raw_bugs
+        self.fetched_minutes = []
+
+    def get_bugs_updated_within(self, project_label, minutes):
+        self.fetched_minutes.append(minutes)
+        return self.raw_bugs
+
+
+def test_first_sync_fetches_back_to_start_date(store):
+    controller = FakeController({'issues': [make_bug('BUG-1', HISTORIES)]})
+    start_date = datetime.date.today() - datetime.timedelta(days=3)
+    before_sync = datetime.datetime.now(datetime.timezone.utc)
+    store.sync(controller, start_date)
+
+    assert controller.fetched_minutes == [4 * 24 * 60]
+    assert store.synced_from == start_date
+    assert store.last_synced >= before_sync
+
+    loaded_store = bug_summary.BugRollupStore(store.path, 'LABEL')
+    assert loaded_store.last_synced == store.last_synced.replace(microsecond=0)
+    assert get_counts(loaded_store.summarise(START_DATE, END_DATE)) == get_counts(
+        store.summarise(START_DATE, END_DATE))
+
+
+def test_later_sync_fetches_since_last_sync_with_overlap(store):
+    controller = FakeController({'issues': []})
+    store.synced_from = datetime.date.today() - datetime.timedelta(days=10)
+    store.last_synced = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(hours=2)
+    store.sync(controller, datetime.date.today() - datetime.timedelta(days=5))
+
+    assert len(controller.fetched_minutes) == 1
+    assert 180 <= controller.fetched_minutes[0] <= 181
+    assert store.synced_from == datetime.date.today() - datetime.timedelta(days=10)
+
+
+def test_sync_before_synced_from_backfills(store):
+    controller = FakeController({'issues': []})
+    store.synced_from = datetime.date.today() - datetime.timedelta(days=2)
+    store.last_synced = datetime.datetime.now(datetime.timezone.utc)
+    start_date = datetime.date.today() - datetime.timedelta(days=7)
+    store.sync(controller, start_date)
+
+    assert controller.fetched_minutes == [8 * 24 * 60]
+    assert store.synced_from == start_date
@@ -1,6 +1,10 @@
 import json
 import requests
 import sys
+import threading
+import time
+import datetime
+import email.utils
 
 STORY_POINTS_KEY='customfield_10005'
 CUSTOMER_KEY='customfield_10400'
@@ -9,6 +13,11 @@ ASSIGNED_TEAM_KEY='customfield_12001'
 TASK_SIZE_KEY='customfield_11900'
 PEER_REVIEWERS_KEY='customfield_10700'
 
+THROTTLED_STATUS_CODE = 429
+MAX_THROTTLED_RETRIES = 5
+
+USER_STORY_DESCRIPTION_FORMAT = 'h6. Description:\n{0}\n\nh6.Acceptance Criteria:\n* {1}\n'
+
 '''
   TODO: Get sprint ID from a sprint name. Currently sprint ID is the sprint name(e.g '#86')
   plus 122.
@@ -34,7 +43,7 @@ class JiraController:
         return JiraController.size_map[size]
 
     def __init__(self, jira_endpoint, jira_username, jira_password,
-                 project, assigned_team, sprint, customer, peer_reviewers):
+                 project, assigned_team, sprint, customer, peer_reviewers, progress_reporter=None):
         self.endpoint = jira_endpoint
         self.username = jira_username
         self.password = jira_password
@@ -47,18 +56,73 @@ class JiraController:
         self.sprint_id = sprint
         self.customer = customer
         self.peer_reviewers = peer_reviewers
+        self.progress_reporter = progress_reporter
+
+        # Fields shared by every issue this controller creates are serialised once here. Each
+        # request then only serialises its own fields and splices them onto these prefixes.
+        shared_fields = JiraController.serialise_fields_fragment({
+            'project': {
+                'key': self.project
+            },
+            CUSTOMER_KEY: {
+                'name': self.customer
+            },
+            PEER_REVIEWERS_KEY: [
+                {'name': reviewer} for reviewer in self.peer_reviewers
+            ]
+        })
+        self.user_story_prefix = '{"fields": {%s, %s, ' % (shared_fields, JiraController.serialise_fields_fragment({
+            'issuetype': {
+                'name': 'User Story'
+            },
+            SPRINT_KEY: self.sprint_id
+        }))
+        self.sub_task_prefix = '{"fields": {%s, %s, ' % (shared_fields, JiraController.serialise_fields_fragment({
+            'issuetype': {
+                'id': '5'
+            },
+            ASSIGNED_TEAM_KEY: {
+                'name': self.assigned_team,
+                'self': '%s/rest/api/2/group?groupname=%s' % (self.endpoint, self.assigned_team)
+            }
+        }))
+
+    @staticmethod
+    def serialise_fields_fragment(fields):
+        # Strip the enclosing braces so the fragment can be joined with other fields.
+        return json.dumps(fields)[1:-1]
 
     def send_jira_request(self, request_body, url_extension='', query_params=''):
         url = '%s/rest/api/2/issue/%s' % (self.endpoint, url_extension)
         if query_params:
             url = '%s?%s' % (url, query_params)
 
-        response = requests.post(url,
-                                 json=request_body,
-                                 headers={
-                                     'Content-Type': 'application/json'
-                                 },
-                                 auth=(self.username, self.password))
+        # Templated requests arrive already serialised.
+        if isinstance(request_body, str):
+            request_args = {'data': request_body.encode('utf-8')}
+        else:
+            request_args = {'json': request_body}
+
+        if self.progress_reporter is not None:
+            self.progress_reporter.request_started()
+        try:
+            for retry_idx in range(MAX_THROTTLED_RETRIES + 1):
+                response = requests.post(url,
+                                         **request_args,
+                                         headers={
+                                             'Content-Type': 'application/json'
+                                         },
+                                         auth=(self.username, self.password))
+                if response.status_code != THROTTLED_STATUS_CODE or retry_idx == MAX_THROTTLED_RETRIES:
+                    break
+
+                # Jira is rate limiting us, back off for as long as it asks before retrying.
+                if self.progress_reporter is not None:
+                    self.progress_reporter.request_retried()
+                time.sleep(get_retry_delay(response, retry_idx))
+        finally:
+            if self.progress_reporter is not None:
+                self.progress_reporter.request_finished()
 
         response_data = response.json() if response.text else None
         if response.status_code < 200 or response.status_code > 299:
@@ -68,29 +132,13 @@ class JiraController:
         return response_data
 
     def create_user_story(self, summary, description, acceptance_criteria, points):
-        description_str = 'h6. Description:\n' + description + '\n\nh6.Acceptance Criteria:\n* ' + \
-                          '\n* '.join(acceptance_criteria) + '\n'
+        description_str = USER_STORY_DESCRIPTION_FORMAT.format(description, '\n* '.join(acceptance_criteria))
 
-        request_body = {
-            'fields': {
-                'project': {
-                    'key': self.project
-                },
-                'issuetype': {
-                    'name': 'User Story'
-                },
-                'summary': summary,
-                'description': description_str,
-                SPRINT_KEY: self.sprint_id,
-                STORY_POINTS_KEY: points,
-                CUSTOMER_KEY: {
-                    'name': self.customer
-                },
-                PEER_REVIEWERS_KEY: [
-                    {'name': reviewer} for reviewer in self.peer_reviewers
-                ]
-            }
-        }
+        request_body = self.user_story_prefix + JiraController.serialise_fields_fragment({
+            'summary': summary,
+            'description': description_str,
+            STORY_POINTS_KEY: points
+        }) + '}}'
 
         return self.send_jira_request(request_body)
 
@@ -105,36 +153,18 @@ class JiraController:
             hours = hours * 60
             size = min(JiraController.size_map.items(), key=lambda x: abs(hours*60 - x[1]))[0]
 
-        request_body = {
-            'fields': {
-                'project': {
-                    'key': self.project
-                },
-                'issuetype': {
-                    'id': '5'
-                },
-                'parent': {
-                    'key': parent_key
-                },
-                'summary': summary,
-                CUSTOMER_KEY: {
-                    'name': self.customer
-                },
-                TASK_SIZE_KEY: {
-                    'value': size
-                },
-                ASSIGNED_TEAM_KEY: {
-                    'name': self.assigned_team,
-                    'self': '%s/rest/api/2/group?groupname=%s' % (self.endpoint, self.assigned_team)
-                },
-                PEER_REVIEWERS_KEY: [
-                    {'name': reviewer} for reviewer in self.peer_reviewers
-                ],
-                'timetracking': {
-                    'originalEstimate': hours
-                }
+        request_body = self.sub_task_prefix + JiraController.serialise_fields_fragment({
+            'parent': {
+                'key': parent_key
+            },
+            'summary': summary,
+            TASK_SIZE_KEY: {
+                'value': size
+            },
+            'timetracking': {
+                'originalEstimate': hours
             }
-        }
+        }) + '}}'
         return self.send_jira_request(request_body)
 
     def approve_issue(self, issue_key):
@@ -148,10 +178,117 @@ class JiraController:
                                       query_params='expand=transitions.fields')
 
 
-def progress_bar(text, value, end_value, bar_length=20):
-    percent = float(value) / end_value
-    arrow = '-' * int(round(percent * bar_length)-1) + '>'
-    spaces = ' ' * (bar_length - len(arrow))
+def get_retry_delay(response, retry_idx):
+    """
+    Returns how long to wait before retrying a throttled response. Retry-After may be given in
+    seconds or as an HTTP date, anything else falls back to an exponential delay.
+    """
+    retry_after = response.headers.get('Retry-After')
+    if retry_after is not None:
+        try:
+            return max(float(retry_after), 0.0)
+        except ValueError:
+            pass
+        try:
+            retry_date = email.utils.parsedate_to_datetime(retry_after)
+            return max((retry_date - datetime.datetime.now(datetime.timezone.utc)).total_seconds(), 0.0)
+        except (TypeError, ValueError):
+            pass
+    return float(2 ** retry_idx)
+
+
+class ProgressReporter:
+    """
+    Thread safe progress and throughput reporting across an entire run. Renders a progress bar
+    at most once per refresh interval on a TTY, otherwise logs a status line every log interval.
+    A background tick keeps rendering while requests hang or back off, until finish is called.
+    """
+    def __init__(self, text, total=0, bar_length=20, refresh_interval=0.2, log_interval=10.0, stream=None):
+        self.text = text
+        self.total = total
+        self.bar_length = bar_length
+        self.stream = stream if stream is not None else sys.stdout
+        self.is_tty = hasattr(self.stream, 'isatty') and self.stream.isatty()
+        self.render_interval = refresh_interval if self.is_tty else log_interval
+
+        self.lock = threading.Lock()
+        self.done = 0
+        self.in_flight = 0
+        self.retries = 0
+        self.start_time = time.monotonic()
+        self.last_progress_time = self.start_time
+        self.last_render_time = None
+
+        self.finished = threading.Event()
+        self.tick_thread = threading.Thread(target=self.tick, daemon=True)
+        self.tick_thread.start()
+
+    def tick(self):
+        while not self.finished.wait(self.render_interval):
+            with self.lock:
+                self.render()
+
+    def add_total(self, count):
+        with self.lock:
+            self.total += count
+
+    def advance(self, count=1):
+        with self.lock:
+            self.done += count
+            self.last_progress_time = time.monotonic()
+            self.render()
+
+    def request_started(self):
+        with self.lock:
+            self.in_flight += 1
+            self.render()
+
+    def request_finished(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def request_retried(self):
+        with self.lock:
+            self.retries += 1
+            self.render()
+
+    def finish(self):
+        self.finished.set()
+        self.tick_thread.join()
+        with self.lock:
+            self.render(force=True)
+            if self.is_tty:
+                self.stream.write('\n')
+                self.stream.flush()
+
+    def get_status(self):
+        now = time.monotonic()
+        elapsed = now - self.start_time
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        if rate > 0:
+            eta_str = '%ds' % round((self.total - self.done) / rate)
+        else:
+            eta_str = '?'
+
+        percent = float(self.done) / self.total if self.total else 0.0
+        return '{0}/{1} ({2}%) {3:.2f} issues/s, ETA {4}, in flight {5}, retries {6}, ' \
+               'last done {7}s ago'.format(self.done, self.total, int(round(percent * 100)), rate, eta_str,
+                                           self.in_flight, self.retries, int(now - self.last_progress_time)), percent
+
+    # Must be called with the lock held.
+    def render(self, force=False):
+        now = time.monotonic()
+        if not force and self.last_render_time is not None and \
+                now - self.last_render_time < self.render_interval:
+            return
+        self.last_render_time = now
 
-    sys.stdout.write('\r{0}: [{1}] {2}%'.format(text, arrow + spaces, int(round(percent * 100))))
-    sys.stdout.flush()
+        status, percent = self.get_status()
+        if self.is_tty:
+            arrow = '-' * max(int(round(percent * self.bar_length)) - 1, 0) + '>'
+            spaces = ' ' * (self.bar_length - len(arrow))
+            # Trailing spaces clear leftovers from a previously longer line.
+            self.stream.write('\r{0}: [{1}] {2}    '.format(self.text, arrow + spaces, status))
+        else:
+            self.stream.write('{0}: {1}\n'.format(self.text, status))
+        self.stream.flush()
@@ -4,7 +4,7 @@ import jsonschema
 import copy
 
 from JiraController import JiraController
-from JiraController import progress_bar
+from JiraController import ProgressReporter
 
 STORY_POINTS_KEY='customfield_10005'
 CUSTOMER_KEY='customfield_10400'
@@ -119,37 +119,48 @@ def main():
     config = config_file['config']
     stories = config_file['stories']
 
+    progress_reporter = ProgressReporter('Progress')
     controller = JiraController(jira_endpoint, jira_username, jira_password,
                                 config['board_key'], config['assigned_team'], config['sprint'],
-                                config['customer'], config['peer_reviewers'])
-
-    for story_idx, story in enumerate(stories):
-        # Expand repeated tasks.
-        expanded_tasks = []
-        for task in story['tasks']:
-            repeat_count = task['repeat'] if 'repeat' in task else 1
-            for repeat_idx in range(repeat_count):
-                tmp_task = copy.deepcopy(task)
-                if repeat_count > 1:
-                    tmp_task['summary'] = '%s pt. %s' % (tmp_task['summary'], repeat_idx + 1)
-                expanded_tasks.append(tmp_task)
-
-        # Default description to summary if it is not given.
-        description_str = story['description'] if 'description' in story else story['summary']
-
-        # Get the total number of time for a user story from it's tasks.
-        total_minute = sum([JiraController.size_to_minutes(task['size']) for task in expanded_tasks])
-        story_json = controller.create_user_story(story['summary'], description_str,
-                                                  story['acceptance_criteria'], total_minute // 60)
-
-        # Create subtasks and attach them to the user story.
-        task_parent = story_json['key']
-
-        # Create all tasks for this story.
-        for task_idx, task in enumerate(expanded_tasks):
-            controller.create_sub_task(task_parent, task['summary'], size=task['size'])
-            progress_bar('Story %d Progress' % story_idx, task_idx + 1, len(expanded_tasks), bar_length=20)
-        sys.stdout.write('\n')
+                                config['customer'], config['peer_reviewers'],
+                                progress_reporter=progress_reporter)
+
+    try:
+        story_tasks = []
+        for story in stories:
+            # Expand repeated tasks.
+            expanded_tasks = []
+            for task in story['tasks']:
+                repeat_count = task['repeat'] if 'repeat' in task else 1
+                for repeat_idx in range(repeat_count):
+                    tmp_task = copy.deepcopy(task)
+                    if repeat_count > 1:
+                        tmp_task['summary'] = '%s pt. %s' % (tmp_task['summary'], repeat_idx + 1)
+                    expanded_tasks.append(tmp_task)
+            story_tasks.append(expanded_tasks)
+
+        # Count every story and task up front so progress covers the whole run.
+        progress_reporter.add_total(len(stories) + sum(len(tasks) for tasks in story_tasks))
+
+        for story, expanded_tasks in zip(stories, story_tasks):
+            # Default description to summary if it is not given.
+            description_str = story['description'] if 'description' in story else story['summary']
+
+            # Get the total number of time for a user story from it's tasks.
+            total_minute = sum([JiraController.size_to_minutes(task['size']) for task in expanded_tasks])
+            story_json = controller.create_user_story(story['summary'], description_str,
+                                                      story['acceptance_criteria'], total_minute // 60)
+            progress_reporter.advance()
+
+            # Create subtasks and attach them to the user story.
+            task_parent = story_json['key']
+
+            # Create all tasks for this story.
+            for task in expanded_tasks:
+                controller.create_sub_task(task_parent, task['summary'], size=task['size'])
+                progress_reporter.advance()
+    finally:
+        progress_reporter.finish()
 
 
 if __name__ == "__main__":
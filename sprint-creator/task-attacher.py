@@ -4,7 +4,7 @@ import jsonschema
 import csv
 
 from JiraController import JiraController
-from JiraController import progress_bar
+from JiraController import ProgressReporter
 
 STORY_POINTS_KEY='customfield_10005'
 CUSTOMER_KEY='customfield_10400'
@@ -67,33 +67,36 @@ def main():
 
     config = config_file['config']
 
+    progress_reporter = ProgressReporter('Progress')
     controller = JiraController(jira_endpoint, jira_username, jira_password,
                                 config['board_key'], config['assigned_team'], None,
-                                config['customer'], config['peer_reviewers'])
-
-    num_tasks = 0
-    with open(tasks_path, 'r') as tasks_file:
-        next(tasks_file)
-        num_tasks = sum(1 for _ in tasks_file)
-
-    with open(tasks_path, 'r') as tasks_file:
-        csv_reader = csv.reader(tasks_file, delimiter=',')
-
-        # Skip header line.
-        next(csv_reader)
-
-        task_idx = 0
-        for row in csv_reader:
-            assert len(row) == 3
-            story_key = row[0]
-            task_summary = row[1]
-            hours = int(row[2])
-
-            response = controller.create_sub_task(story_key, task_summary, hours=hours)
-            controller.approve_issue(response['key'])
-            progress_bar('Progress', task_idx + 1, num_tasks, bar_length=20)
-            task_idx += 1
-        sys.stdout.write('\n')
+                                config['customer'], config['peer_reviewers'],
+                                progress_reporter=progress_reporter)
+
+    try:
+        num_tasks = 0
+        with open(tasks_path, 'r') as tasks_file:
+            next(tasks_file)
+            num_tasks = sum(1 for _ in tasks_file)
+        progress_reporter.add_total(num_tasks)
+
+        with open(tasks_path, 'r') as tasks_file:
+            csv_reader = csv.reader(tasks_file, delimiter=',')
+
+            # Skip header line.
+            next(csv_reader)
+
+            for row in csv_reader:
+                assert len(row) == 3
+                story_key = row[0]
+                task_summary = row[1]
+                hours = int(row[2])
+
+                response = controller.create_sub_task(story_key, task_summary, hours=hours)
+                controller.approve_issue(response['key'])
+                progress_reporter.advance()
+    finally:
+        progress_reporter.finish()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,264 @@
+import io
+import threading
+import time
+from json import loads as json_loads
+
+import pytest
+
+import JiraController as jira_controller
+from JiraController import JiraController
+
+ENDPOINT = 'https://example.atlassian.net'
+
+
+class FakeResponse:
+    status_code = 201
+    reason = 'Created'
+    text = '{"key": "RAP-1"}'
+    headers = {}
+
+    def json(self):
+        return {'key': 'RAP-1'}
+
+
+@pytest.fixture
+def sent_bodies(monkeypatch):
+    bodies = []
+
+    def fake_post(url, json=None, data=None, **kwargs):
+        # Templated bodies arrive pre-serialised, so decode them back for comparison.
+        bodies.append(json if data is None else json_loads(data.decode('utf-8')))
+        return FakeResponse()
+
+    monkeypatch.setattr(jira_controller.requests, 'post', fake_post)
+    return bodies
+
+
+def make_controller(sprint=86, customer='jack.turpitt', peer_reviewers=('John Smith', 'Mary Jane')):
+    return JiraController(ENDPOINT, 'user', 'password', 'RAP', 'rapid', sprint, customer, list(peer_reviewers))
+
+
+# The request bodies as they were built before the shared fields were templated.
+def expected_user_story(controller, summary, description, acceptance_criteria, points):
+    description_str = 'h6. Description:\n' + description + '\n\nh6.Acceptance Criteria:\n* ' + \
+                      '\n* '.join(acceptance_criteria) + '\n'
+    return {
+        'fields': {
+            'project': {
+                'key': controller.project
+            },
+            'issuetype': {
+                'name': 'User Story'
+            },
+            'summary': summary,
+            'description': description_str,
+            jira_controller.SPRINT_KEY: controller.sprint_id,
+            jira_controller.STORY_POINTS_KEY: points,
+            jira_controller.CUSTOMER_KEY: {
+                'name': controller.customer
+            },
+            jira_controller.PEER_REVIEWERS_KEY: [
+                {'name': reviewer} for reviewer in controller.peer_reviewers
+            ]
+        }
+    }
+
+
+def expected_sub_task(controller, parent_key, summary, size=None, hours=None):
+    if size is not None:
+        hours = JiraController.size_to_minutes(size)
+    else:
+        hours = hours * 60
+        size = min(JiraController.size_map.items(), key=lambda x: abs(hours*60 - x[1]))[0]
+
+    return {
+        'fields': {
+            'project': {
+                'key': controller.project
+            },
+            'issuetype': {
+                'id': '5'
+            },
+            'parent': {
+                'key': parent_key
+            },
+            'summary': summary,
+            jira_controller.CUSTOMER_KEY: {
+                'name': controller.customer
+            },
+            jira_controller.TASK_SIZE_KEY: {
+                'value': size
+            },
+            jira_controller.ASSIGNED_TEAM_KEY: {
+                'name': controller.assigned_team,
+                'self': '%s/rest/api/2/group?groupname=%s' % (controller.endpoint, controller.assigned_team)
+            },
+            jira_controller.PEER_REVIEWERS_KEY: [
+                {'name': reviewer} for reviewer in controller.peer_reviewers
+            ],
+            'timetracking': {
+                'originalEstimate': hours
+            }
+        }
+    }
+
+
+CONTROLLERS = [
+    {},
+    {'peer_reviewers': []},
+    {'sprint': None},
+    {'customer': 'zoë "q" 100%', 'peer_reviewers': ['Jürgen \\ O\'Neil', '"Quoted"']},
+]
+
+STORIES = [
+    ('A story', 'Plain description', ['criteria 1', 'criteria 2'], 12),
+    ('Ünïcödé "quotes" & 100% 日本', 'Line one\nline "two" \\ ✓', ['crïteria "1"'], 0),
+]
+
+SUB_TASKS = [
+    ('RAP-1', 'Sized task', {'size': 'M'}),
+    ('RAP-1', 'Sized task', {'size': 'XS'}),
+    ('RAP-2', 'Hours task', {'hours': 3}),
+    ('RAP-2', 'Tâche "heures" ✓', {'hours': 0}),
+]
+
+
+@pytest.mark.parametrize('controller_kwargs', CONTROLLERS)
+@pytest.mark.parametrize('story', STORIES)
+def test_create_user_story_payload(sent_bodies, controller_kwargs, story):
+    controller = make_controller(**controller_kwargs)
+    controller.create_user_story(*story)
+    assert sent_bodies == [expected_user_story(controller, *story)]
+
+
+@pytest.mark.parametrize('controller_kwargs', CONTROLLERS)
+@pytest.mark.parametrize('parent_key, summary, size_kwargs', SUB_TASKS)
+def test_create_sub_task_payload(sent_bodies, controller_kwargs, parent_key, summary, size_kwargs):
+    controller = make_controller(**controller_kwargs)
+    controller.create_sub_task(parent_key, summary, **size_kwargs)
+    assert sent_bodies == [expected_sub_task(controller, parent_key, summary, **size_kwargs)]
+
+
+@pytest.mark.parametrize('headers, expected_delay', [
+    ({'Retry-After': '5'}, 5.0),
+    ({'Retry-After': 'Wed, 21 Oct 2015 07:28:00 GMT'}, 0.0),
+    ({'Retry-After': 'soon'}, 4.0),
+    ({}, 4.0),
+])
+def test_get_retry_delay(headers, expected_delay):
+    response = FakeResponse()
+    response.headers = headers
+    assert jira_controller.get_retry_delay(response, 2) == expected_delay
+
+
+def make_reporter(total=0, **kwargs):
+    stream = io.StringIO()
+    return jira_controller.ProgressReporter('Progress', total=total, stream=stream, **kwargs), stream
+
+
+def test_progress_reporter_throttles_log_lines():
+    # A long log interval keeps the background tick quiet for the length of the test.
+    reporter, stream = make_reporter(total=3, log_interval=60)
+    for _ in range(3):
+        reporter.advance()
+    reporter.finish()
+
+    lines = stream.getvalue().splitlines()
+    assert len(lines) == 2
+    assert lines[0].startswith('Progress: 1/3 (33%)')
+    assert lines[1].startswith('Progress: 3/3 (100%)')
+    assert '\r' not in stream.getvalue()
+
+
+def test_progress_reporter_logs_while_requests_are_in_flight():
+    reporter, stream = make_reporter(total=1, log_interval=0.05)
+    reporter.request_started()
+    time.sleep(0.3)
+    reporter.request_finished()
+    reporter.advance()
+    reporter.finish()
+
+    in_flight_lines = [line for line in stream.getvalue().splitlines() if 'in flight 1' in line]
+    assert len(in_flight_lines) >= 2
+    assert all(line.startswith('Progress: 0/1 (0%)') for line in in_flight_lines)
+
+
+def test_progress_reporter_counts_across_threads():
+    reporter, stream = make_reporter(log_interval=60)
+
+    def work():
+        reporter.add_total(100)
+        for _ in range(100):
+            reporter.request_started()
+            reporter.request_finished()
+            reporter.advance()
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    reporter.finish()
+
+    assert reporter.done == reporter.total == 800
+    assert reporter.in_flight == 0
+    assert stream.getvalue().splitlines()[-1].startswith('Progress: 800/800 (100%)')
+
+
+class ThrottledResponse(FakeResponse):
+    status_code = 429
+    reason = 'Too Many Requests'
+    text = ''
+    headers = {'Retry-After': '1'}
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    delays = []
+    monkeypatch.setattr(jira_controller.time, 'sleep', delays.append)
+    return delays
+
+
+def test_throttled_request_is_retried(monkeypatch, sleeps):
+    responses = [ThrottledResponse(), ThrottledResponse(), FakeResponse()]
+    monkeypatch.setattr(jira_controller.requests, 'post', lambda *args, **kwargs: responses.pop(0))
+    reporter, _ = make_reporter(log_interval=60)
+    controller = JiraController(ENDPOINT, 'user', 'password', 'RAP', 'rapid', 86, 'customer', [],
+                                progress_reporter=reporter)
+
+    assert controller.create_sub_task('RAP-1', 'Task', size='S') == {'key': 'RAP-1'}
+    reporter.finish()
+    assert sleeps == [1.0, 1.0]
+    assert reporter.retries == 2
+    assert reporter.in_flight == 0
+
+
+def test_throttled_request_gives_up_after_max_retries(monkeypatch, sleeps):
+    posts = []
+    monkeypatch.setattr(jira_controller.requests, 'post',
+                        lambda *args, **kwargs: posts.append(args) or ThrottledResponse())
+    reporter, _ = make_reporter(log_interval=60)
+    controller = JiraController(ENDPOINT, 'user', 'password', 'RAP', 'rapid', 86, 'customer', [],
+                                progress_reporter=reporter)
+
+    with pytest.raises(RuntimeError):
+        controller.create_sub_task('RAP-1', 'Task', size='S')
+    reporter.finish()
+    assert len(posts) == jira_controller.MAX_THROTTLED_RETRIES + 1
+    assert len(sleeps) == reporter.retries == jira_controller.MAX_THROTTLED_RETRIES
+    assert reporter.in_flight == 0
+
+
+def test_in_flight_is_released_when_post_raises(monkeypatch):
+    def failing_post(*args, **kwargs):
+        raise jira_controller.requests.ConnectionError('connection refused')
+
+    monkeypatch.setattr(jira_controller.requests, 'post', failing_post)
+    reporter, _ = make_reporter(log_interval=60)
+    controller = JiraController(ENDPOINT, 'user', 'password', 'RAP', 'rapid', 86, 'customer', [],
+                                progress_reporter=reporter)
+
+    with pytest.raises(jira_controller.requests.ConnectionError):
+        controller.create_sub_task('RAP-1', 'Task', size='S')
+    reporter.finish()
+    assert reporter.in_flight == 0